@@ -1,11 +1,15 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from io import BytesIO
 from datetime import datetime, timedelta
 from streamlit_autorefresh import st_autorefresh
 import json
 import locale
+import uuid
+import hashlib
+import time
 
 # Configura o locale para português para exibir o nome do mês corretamente
 try:
@@ -74,19 +78,30 @@ def main_app():
 
     DOC_ID_NEW = "dados_gerais_v3"
     COLLECTION_NAME = "analisador_ls_data"
+    # Operações encerradas ficam numa coleção separada (um documento por operação),
+    # para que o documento principal carregue apenas as posições ativas.
+    ARCHIVE_COLLECTION_NAME = "analisador_ls_historico"
+    ARCHIVE_CACHE_TTL = 300 # Segundos; também define de quanto em quanto tempo o relatório relê o arquivo
+
+    def bump_data_version():
+        # Invalida a tabela do relatório mantida na sessão (ver get_report_table).
+        st.session_state.data_version = st.session_state.get("data_version", 0) + 1
 
     def save_data_to_firestore(data):
-        if db_client is None: return
+        bump_data_version()
+        if db_client is None: return True
         try:
             doc_ref = db_client.collection(COLLECTION_NAME).document(DOC_ID_NEW)
             serializable_data = json.loads(json.dumps(data, default=str))
             doc_ref.set(serializable_data) # Salva o dicionário completo
+            return True
         except Exception as e:
             st.error(f"Erro ao salvar no Firestore: {e}")
+            return False
 
     # --- FUNÇÃO DE CARREGAMENTO COM MIGRAÇÃO ROBUSTA ---
     def load_data_from_firestore():
-        if db_client is None: return {"assessores": {}, "potenciais": {}}
+        if db_client is None: return {"assessores": {}, "potenciais": {}, "historico_resumo": {}}
         try:
             doc_ref = db_client.collection(COLLECTION_NAME).document(DOC_ID_NEW)
             doc = doc_ref.get()
@@ -96,11 +111,186 @@ def main_app():
                     data["assessores"] = {}
                 if "potenciais" not in data:
                     data["potenciais"] = {}
+                if "historico_resumo" not in data:
+                    data["historico_resumo"] = {}
+                if migrate_closed_operations(data):
+                    save_data_to_firestore(data)
                 return data
-            return {"assessores": {}, "potenciais": {}}
+            return {"assessores": {}, "potenciais": {}, "historico_resumo": {}}
         except Exception as e:
             st.error(f"Erro ao carregar dados do Firestore: {e}")
-            return {"assessores": {}, "potenciais": {}}
+            return {"assessores": {}, "potenciais": {}, "historico_resumo": {}}
+
+    # --- ARQUIVO DE OPERAÇÕES ENCERRADAS ---
+    def parse_data_br(data_str):
+        try:
+            return datetime.strptime(data_str, "%d/%m/%Y")
+        except (ValueError, TypeError):
+            return None
+
+    def update_history_summary(data, assessor, cliente, op, sign=1):
+        """Soma (sign=1) ou subtrai (sign=-1) uma operação encerrada dos resumos históricos pré-calculados."""
+        resumo = data.setdefault("historico_resumo", {}).setdefault(assessor, {"mensal": {}, "clientes": {}})
+        resumo_cliente = resumo["clientes"].setdefault(cliente, {"volume_entrada": 0, "volume_saida": 0})
+        volume_saida = op.get('quantidade', 0) * op.get('preco_encerramento', 0)
+        resumo_cliente["volume_entrada"] += sign * op.get('quantidade', 0) * op.get('preco_exec', 0)
+        resumo_cliente["volume_saida"] += sign * volume_saida
+        data_encerramento_dt = parse_data_br(op.get('data_encerramento'))
+        if data_encerramento_dt:
+            resumo_mes = resumo["mensal"].setdefault(data_encerramento_dt.strftime("%Y-%m"), {"financeiro": 0, "resultado": 0})
+            resumo_mes["financeiro"] += sign * volume_saida
+            resumo_mes["resultado"] += sign * op.get('lucro_final', 0)
+
+    def build_archive_record(assessor, cliente, op):
+        record = {k: v for k, v in op.items() if k != 'id'}
+        record['assessor'] = assessor
+        record['cliente'] = cliente
+        # Sem data de encerramento válida, usa a data de abertura (ou a de hoje) para que a
+        # operação continue alcançável pelas consultas por período.
+        data_referencia_dt = parse_data_br(op.get('data_encerramento')) or parse_data_br(op.get('data')) or datetime.now()
+        record['data_encerramento_iso'] = data_referencia_dt.strftime("%Y-%m-%d")
+        return json.loads(json.dumps(record, default=str))
+
+    def write_archive(entries=(), deleted_ids=()):
+        """Grava (assessor, cliente, op) no arquivo usando op['id'] como ID do documento, para que uma
+        nova tentativa sobrescreva em vez de duplicar, e exclui os IDs informados, em lotes.
+        Retorna False em caso de erro."""
+        if db_client is None:
+            arquivo_local = st.session_state.setdefault("arquivo_local", {})
+            for assessor, cliente, op in entries:
+                arquivo_local[op['id']] = build_archive_record(assessor, cliente, op)
+            for op_id in deleted_ids:
+                arquivo_local.pop(op_id, None)
+            return True
+        try:
+            collection = db_client.collection(ARCHIVE_COLLECTION_NAME)
+            writes = [('set', entry) for entry in entries] + [('delete', op_id) for op_id in deleted_ids]
+            for start in range(0, len(writes), 500): # Limite de escritas por lote do Firestore
+                batch = db_client.batch()
+                for kind, item in writes[start:start + 500]:
+                    if kind == 'set':
+                        assessor, cliente, op = item
+                        batch.set(collection.document(op['id']), build_archive_record(assessor, cliente, op))
+                    else:
+                        batch.delete(collection.document(item))
+                batch.commit()
+            return True
+        except Exception as e:
+            st.error(f"Erro ao gravar o arquivo de operações no Firestore: {e}")
+            return False
+        finally:
+            query_archive_firestore.clear()
+            bump_data_version()
+
+    def archive_operations(entries):
+        return write_archive(entries=entries)
+
+    def update_archived_operation(assessor, cliente, op):
+        if db_client is None:
+            st.session_state.setdefault("arquivo_local", {})[op['id']] = build_archive_record(assessor, cliente, op)
+            return True
+        try:
+            db_client.collection(ARCHIVE_COLLECTION_NAME).document(op['id']).set(build_archive_record(assessor, cliente, op))
+            return True
+        except Exception as e:
+            st.error(f"Erro ao salvar operação arquivada no Firestore: {e}")
+            return False
+        finally:
+            query_archive_firestore.clear()
+            bump_data_version()
+
+    def get_archived_client_operations(assessor, cliente):
+        """Retorna todas as operações arquivadas de um cliente (usado ao renomear ou excluir o cliente)."""
+        if db_client is None:
+            return [dict(record, id=doc_id) for doc_id, record in st.session_state.get("arquivo_local", {}).items()
+                    if record.get('assessor') == assessor and record.get('cliente') == cliente]
+        query = (db_client.collection(ARCHIVE_COLLECTION_NAME)
+                 .where(filter=firestore.FieldFilter("assessor", "==", assessor))
+                 .where(filter=firestore.FieldFilter("cliente", "==", cliente)))
+        return [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+
+    def rename_archived_client(data, assessor, old_cliente, new_cliente):
+        """Renomeia o cliente no arquivo e nos resumos. Retorna False (sem alterar os resumos) em caso de erro."""
+        try:
+            operacoes = get_archived_client_operations(assessor, old_cliente)
+        except Exception as e:
+            st.error(f"Erro ao consultar o arquivo do cliente: {e}")
+            return False
+        if not write_archive(entries=[(assessor, new_cliente, op) for op in operacoes]):
+            return False
+        resumo_clientes = data.get("historico_resumo", {}).get(assessor, {}).get("clientes", {})
+        if old_cliente in resumo_clientes:
+            resumo_clientes[new_cliente] = resumo_clientes.pop(old_cliente)
+        return True
+
+    def delete_archived_client(data, assessor, cliente):
+        """Exclui as operações arquivadas do cliente e as retira dos resumos. Retorna False em caso de erro."""
+        try:
+            operacoes = get_archived_client_operations(assessor, cliente)
+        except Exception as e:
+            st.error(f"Erro ao consultar o arquivo do cliente: {e}")
+            return False
+        if not write_archive(deleted_ids=[op['id'] for op in operacoes]):
+            return False
+        for op in operacoes:
+            update_history_summary(data, assessor, cliente, op, sign=-1)
+        data.get("historico_resumo", {}).get(assessor, {}).get("clientes", {}).pop(cliente, None)
+        return True
+
+    @st.cache_data(ttl=ARCHIVE_CACHE_TTL)
+    def query_archive_firestore(inicio_iso, fim_iso):
+        query = (db_client.collection(ARCHIVE_COLLECTION_NAME)
+                 .where(filter=firestore.FieldFilter("data_encerramento_iso", ">=", inicio_iso))
+                 .where(filter=firestore.FieldFilter("data_encerramento_iso", "<=", fim_iso)))
+        return [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+
+    def load_archived_operations(data_inicio, data_fim):
+        """Consulta sob demanda as operações encerradas cuja data de encerramento está no intervalo."""
+        inicio_iso, fim_iso = data_inicio.strftime("%Y-%m-%d"), data_fim.strftime("%Y-%m-%d")
+        if db_client is None:
+            operacoes = [dict(record, id=doc_id) for doc_id, record in st.session_state.get("arquivo_local", {}).items()
+                         if inicio_iso <= record.get('data_encerramento_iso', "") <= fim_iso]
+        else:
+            try:
+                operacoes = query_archive_firestore(inicio_iso, fim_iso)
+            except Exception as e:
+                st.error(f"Erro ao consultar o histórico no Firestore: {e}")
+                return []
+        return sorted(operacoes, key=lambda op: op.get('data_encerramento_iso', ""))
+
+    def migrate_closed_operations(data):
+        """Move para o arquivo as operações encerradas que ainda estão no documento principal."""
+        entries = []
+        sem_id = False
+        for assessor, clientes in data["assessores"].items():
+            for cliente, operacoes in clientes.items():
+                for posicao, op in enumerate(operacoes):
+                    if op.get('status') != 'encerrada':
+                        continue
+                    # ID determinístico: sessões que carregam o mesmo documento legado
+                    # chegam ao mesmo ID e regravam o mesmo documento no arquivo.
+                    if 'id' not in op:
+                        chave = json.dumps([assessor, cliente, posicao, op], sort_keys=True, default=str)
+                        op['id'] = hashlib.sha1(chave.encode("utf-8")).hexdigest()
+                        sem_id = True
+                    entries.append((assessor, cliente, op))
+        if not entries:
+            return False
+        # Os IDs são persistidos antes de arquivar: se a migração for interrompida,
+        # a próxima carga regrava os mesmos documentos em vez de duplicá-los.
+        if sem_id and not save_data_to_firestore(data):
+            return False
+        sem_data = sum(1 for _, _, op in entries if parse_data_br(op.get('data_encerramento')) is None)
+        if sem_data:
+            st.warning(f"{sem_data} operação(ões) encerrada(s) sem data de encerramento válida foram arquivadas com a data de abertura.")
+        if not archive_operations(entries):
+            return False
+        for assessor, cliente, op in entries:
+            update_history_summary(data, assessor, cliente, op)
+        for clientes in data["assessores"].values():
+            for cliente, operacoes in clientes.items():
+                clientes[cliente] = [op for op in operacoes if op.get('status') != 'encerrada']
+        return True
 
 
     # --- FUNÇÃO get_stock_data ---
@@ -176,6 +366,93 @@ def main_app():
 
         return bytes(pdf.output())
 
+    # --- MOTOR DE CONSULTA DE RELATÓRIOS ---
+    REPORT_COLUMNS = ['assessor', 'cliente', 'ativo', 'tipo', 'quantidade', 'preco_exec', 'data', 'status', 'stop_gain', 'stop_loss', 'preco_encerramento', 'data_encerramento', 'lucro_final']
+    REPORT_EXPORT_COLUMNS = REPORT_COLUMNS + ['volume_financeiro']
+
+    def build_operations_table(assessores, archived_ops):
+        """Monta a tabela colunar de operações (ativas do documento principal + encerradas do arquivo)."""
+        columns = {col: [] for col in REPORT_COLUMNS}
+        rows = [(assessor, cliente, op) for assessor, clientes in assessores.items() for cliente, operacoes in clientes.items() for op in operacoes]
+        rows += [(op.get('assessor'), op.get('cliente'), op) for op in archived_ops]
+        for assessor, cliente, op in rows:
+            columns['assessor'].append(assessor)
+            columns['cliente'].append(cliente)
+            for col in REPORT_COLUMNS[2:]:
+                columns[col].append(op.get(col))
+
+        table = pd.DataFrame(columns)
+        table['status'] = table['status'].fillna('ativa')
+        for col in ('assessor', 'cliente', 'ativo', 'tipo', 'status'):
+            table[col] = table[col].astype('category')
+        for col in ('quantidade', 'preco_exec', 'stop_gain', 'stop_loss', 'preco_encerramento', 'lucro_final'):
+            table[col] = pd.to_numeric(table[col], errors='coerce')
+        table['volume_financeiro'] = table['quantidade'] * table['preco_exec']
+        table['data_abertura_dt'] = pd.to_datetime(table['data'], format="%d/%m/%Y", errors='coerce')
+        table['data_encerramento_dt'] = pd.to_datetime(table['data_encerramento'], format="%d/%m/%Y", errors='coerce')
+        return table
+
+    def build_report_indexes(table):
+        """Índices por posição: listas invertidas para colunas categóricas e ordenação para a data de abertura.
+        O período de encerramento já é resolvido pela consulta ao arquivo."""
+        indexes = {col: table.groupby(col, observed=True).indices for col in ('assessor', 'cliente', 'ativo', 'status')}
+        values = table['data_abertura_dt'].to_numpy()
+        order = np.argsort(values, kind='stable') # NaT fica no final
+        indexes['data_abertura_dt'] = (order, values[order])
+        return indexes
+
+    def get_report_table(status_relatorio, periodo_encerramento):
+        """Tabela e índices do relatório, mantidos na sessão e reconstruídos quando o status, o período de
+        encerramento ou os dados (data_version) mudam, ou a cada ARCHIVE_CACHE_TTL segundos, para
+        incluir operações arquivadas por outras sessões."""
+        janela = int(time.time() // ARCHIVE_CACHE_TTL)
+        chave = (status_relatorio, periodo_encerramento, st.session_state.get("data_version", 0), janela)
+        cache = st.session_state.get("report_table_cache")
+        if cache is None or cache[0] != chave:
+            archived_ops = load_archived_operations(*periodo_encerramento) if periodo_encerramento else []
+            assessores = st.session_state.app_data["assessores"] if status_relatorio in ("Ativas", "Todas") else {}
+            table = build_operations_table(assessores, archived_ops)
+            cache = (chave, table, build_report_indexes(table))
+            st.session_state.report_table_cache = cache
+        return cache[1], cache[2]
+
+    def query_operations(table, indexes, status=None, assessores=None, clientes=None, ativos=None,
+                         abertura=None, lucro_min=None, lucro_max=None):
+        """Filtra a tabela pelos índices e devolve apenas as linhas selecionadas, sem cópias intermediárias.
+        Um filtro None é ignorado; uma lista vazia não seleciona nenhuma linha."""
+        selected = np.arange(len(table))
+        for col, values in (('status', status), ('assessor', assessores), ('cliente', clientes), ('ativo', ativos)):
+            if values is not None:
+                positions = [indexes[col][v] for v in values if v in indexes[col]]
+                selected = np.intersect1d(selected, np.concatenate(positions) if positions else np.empty(0, dtype=np.intp), assume_unique=True)
+        if abertura:
+            order, sorted_values = indexes['data_abertura_dt']
+            start = np.searchsorted(sorted_values, np.datetime64(pd.Timestamp(abertura[0])), side='left')
+            end = np.searchsorted(sorted_values, np.datetime64(pd.Timestamp(abertura[1])), side='right')
+            selected = np.intersect1d(selected, order[start:end], assume_unique=True)
+        if lucro_min is not None or lucro_max is not None:
+            lucro = table['lucro_final'].to_numpy()[selected]
+            mask = np.ones(len(selected), dtype=bool)
+            if lucro_min is not None: mask &= lucro >= lucro_min
+            if lucro_max is not None: mask &= lucro <= lucro_max
+            selected = selected[mask]
+        return table.take(selected)
+
+    def aggregate_operations(result, agrupamento):
+        """Agrega o resultado por mês (encerramento, ou abertura para ativas), ativo ou cliente."""
+        if agrupamento == "Mês":
+            chave = result['data_encerramento_dt'].fillna(result['data_abertura_dt']).dt.strftime("%Y-%m").rename("mes")
+        else:
+            chave = {"Ativo": 'ativo', "Cliente": 'cliente'}[agrupamento]
+        # dropna=False mantém operações sem data válida, para os totais baterem com o detalhe;
+        # min_count=1 deixa o lucro vazio (e não R$ 0,00) em grupos só com operações ativas.
+        return result.groupby(chave, observed=True, dropna=False).agg(
+            operacoes=('ativo', 'size'),
+            quantidade=('quantidade', 'sum'),
+            volume_financeiro=('volume_financeiro', 'sum'),
+            lucro_final=('lucro_final', lambda lucro: lucro.sum(min_count=1)),
+        ).reset_index()
+
 
     # --- FEEDBACK DE CONEXÃO ---
     if db_client:
@@ -230,6 +507,8 @@ def main_app():
                 st.session_state.app_data["assessores"] = {}
             if "potenciais" not in st.session_state.app_data:
                 st.session_state.app_data["potenciais"] = {}
+            if "historico_resumo" not in st.session_state.app_data:
+                st.session_state.app_data["historico_resumo"] = {}
 
     if "editing_operation" not in st.session_state: st.session_state.editing_operation = None
     if "editing_client" not in st.session_state: st.session_state.editing_client = None
@@ -247,19 +526,26 @@ def main_app():
         with st.form("edit_client_form"):
             new_client_name = st.text_input("Novo nome do Cliente", value=old_client_name)
             if st.form_submit_button("Salvar Alterações"):
+                renomeado = True
                 if new_client_name and new_client_name != old_client_name:
-                    st.session_state.app_data["assessores"][assessor_edit][new_client_name] = st.session_state.app_data["assessores"][assessor_edit].pop(old_client_name)
-                    save_data_to_firestore(st.session_state.app_data)
-                st.session_state.editing_client = None
-                st.rerun()
+                    # O cliente só é renomeado no documento principal se o arquivo foi atualizado.
+                    renomeado = rename_archived_client(st.session_state.app_data, assessor_edit, old_client_name, new_client_name)
+                    if renomeado:
+                        st.session_state.app_data["assessores"][assessor_edit][new_client_name] = st.session_state.app_data["assessores"][assessor_edit].pop(old_client_name)
+                        save_data_to_firestore(st.session_state.app_data)
+                if renomeado:
+                    st.session_state.editing_client = None
+                    st.rerun()
             if st.form_submit_button("Cancelar"):
                 st.session_state.editing_client = None
                 st.rerun()
 
     # MODO DE EDIÇÃO DE OPERAÇÃO
     elif st.session_state.editing_operation:
-        assessor_edit, cliente_edit, op_index_edit = st.session_state.editing_operation
-        op_data = st.session_state.app_data["assessores"][assessor_edit][cliente_edit][op_index_edit]
+        assessor_edit, cliente_edit, op_ref_edit = st.session_state.editing_operation
+        # Operações encerradas vêm do arquivo (dict com 'id'); as ativas são referenciadas pelo índice.
+        is_archived_edit = isinstance(op_ref_edit, dict)
+        op_data = op_ref_edit if is_archived_edit else st.session_state.app_data["assessores"][assessor_edit][cliente_edit][op_ref_edit]
         is_active_edit = op_data.get('status', 'ativa') == 'ativa'
         
         st.subheader(f"Editando Operação: {op_data['ativo']}")
@@ -277,6 +563,7 @@ def main_app():
                 new_stop_loss = st.number_input("Stop Loss", format="%.2f", min_value=0.0, value=op_data.get('stop_loss', 0.0))
 
             if st.form_submit_button("Salvar"):
+                op_original = dict(op_data)
                 op_data.update({'quantidade': new_quantidade, 'preco_exec': new_preco_exec})
                 if is_active_edit:
                     op_data.update({'stop_gain': new_stop_gain, 'stop_loss': new_stop_loss})
@@ -288,6 +575,9 @@ def main_app():
                     lucro_bruto = (new_preco_encerramento - preco_exec) * qtd if tipo == 'c' else (preco_exec - new_preco_encerramento) * qtd
                     op_data['lucro_final'] = lucro_bruto - custo_total
 
+                if is_archived_edit and update_archived_operation(assessor_edit, cliente_edit, op_data):
+                    update_history_summary(st.session_state.app_data, assessor_edit, cliente_edit, op_original, sign=-1)
+                    update_history_summary(st.session_state.app_data, assessor_edit, cliente_edit, op_data)
                 save_data_to_firestore(st.session_state.app_data)
                 st.session_state.editing_operation = None
                 st.rerun()
@@ -304,17 +594,28 @@ def main_app():
             preco_encerramento = st.number_input("Preço de Encerramento (R$)", format="%.2f", min_value=0.01)
             data_encerramento = st.date_input("Data de Encerramento", datetime.now(), format="DD/MM/YYYY")
             if st.form_submit_button("Confirmar Encerramento"):
-                op_data['status'] = 'encerrada'
-                op_data['preco_encerramento'] = preco_encerramento
-                op_data['data_encerramento'] = data_encerramento.strftime("%d/%m/%Y")
-                qtd, preco_exec, tipo = op_data["quantidade"], op_data["preco_exec"], op_data["tipo"]
+                op_data.setdefault('id', uuid.uuid4().hex)
+                op_encerrada = dict(op_data)
+                op_encerrada['status'] = 'encerrada'
+                op_encerrada['preco_encerramento'] = preco_encerramento
+                op_encerrada['data_encerramento'] = data_encerramento.strftime("%d/%m/%Y")
+                qtd, preco_exec, tipo = op_encerrada["quantidade"], op_encerrada["preco_exec"], op_encerrada["tipo"]
                 valor_entrada, valor_saida = qtd * preco_exec, qtd * preco_encerramento
                 custo_total = (valor_entrada * 0.005) + (valor_saida * 0.005)
                 lucro_bruto = (preco_encerramento - preco_exec) * qtd if tipo == 'c' else (preco_exec - preco_encerramento) * qtd
-                op_data['lucro_final'] = lucro_bruto - custo_total
-                save_data_to_firestore(st.session_state.app_data)
-                st.session_state.closing_operation = None
-                st.rerun()
+                op_encerrada['lucro_final'] = lucro_bruto - custo_total
+                # A operação só sai do documento principal depois de gravada no arquivo.
+                if archive_operations([(assessor_close, cliente_close, op_encerrada)]):
+                    operacoes_close = st.session_state.app_data["assessores"][assessor_close][cliente_close]
+                    operacoes_close.pop(op_index_close)
+                    update_history_summary(st.session_state.app_data, assessor_close, cliente_close, op_encerrada)
+                    if save_data_to_firestore(st.session_state.app_data):
+                        st.session_state.closing_operation = None
+                        st.rerun()
+                    # Falha ao salvar: desfaz o encerramento para não deixar a operação em dois lugares.
+                    operacoes_close.insert(op_index_close, op_data)
+                    update_history_summary(st.session_state.app_data, assessor_close, cliente_close, op_encerrada, sign=-1)
+                    write_archive(deleted_ids=[op_encerrada['id']])
             if st.form_submit_button("Cancelar"):
                 st.session_state.closing_operation = None
                 st.rerun()
@@ -424,7 +725,7 @@ def main_app():
                     new_op = {
                         "ativo": ativo, "tipo": "c" if tipo_operacao == "Compra" else "v", "quantidade": quantidade,
                         "preco_exec": preco_exec, "data": data_operacao.strftime("%d/%m/%Y"),
-                        "stop_gain": stop_gain, "stop_loss": stop_loss, "status": 'ativa'
+                        "stop_gain": stop_gain, "stop_loss": stop_loss, "status": 'ativa', "id": uuid.uuid4().hex
                     }
                     st.session_state.app_data["assessores"][assessor][cliente].append(new_op)
                     save_data_to_firestore(st.session_state.app_data)
@@ -432,6 +733,19 @@ def main_app():
 
         st.divider()
         st.subheader("Visão Geral das Carteiras")
+
+        # O histórico é consultado uma única vez por execução, e só quando solicitado.
+        col_historico, col_periodo = st.columns([1, 2])
+        mostrar_encerradas = col_historico.toggle("Carregar operações encerradas", key="mostrar_encerradas")
+        encerradas_por_cliente = {}
+        if mostrar_encerradas:
+            periodo_encerradas = col_periodo.date_input(
+                "Período de Encerramento", (datetime.now() - timedelta(days=90), datetime.now()),
+                format="DD/MM/YYYY", key="periodo_encerradas"
+            )
+            if len(periodo_encerradas) == 2:
+                for op in load_archived_operations(*periodo_encerradas):
+                    encerradas_por_cliente.setdefault((op.get('assessor'), op.get('cliente')), []).append(op)
         
         if not st.session_state.app_data["assessores"]:
             st.info("Adicione uma operação no formulário acima para começar a análise.")
@@ -458,19 +772,11 @@ def main_app():
                     meses_em_portugues = {1: "Janeiro", 2: "Fevereiro", 3: "Março", 4: "Abril", 5: "Maio", 6: "Junho", 7: "Julho", 8: "Agosto", 9: "Setembro", 10: "Outubro", 11: "Novembro", 12: "Dezembro"}
                     month_name = meses_em_portugues.get(target_month, "")
 
-                    financeiro_encerrado_mes = 0
-                    resultado_encerrado_mes = 0
-                    for ops in clientes.values():
-                        for op in ops:
-                            if op.get('status') == 'encerrada' and 'data_encerramento' in op:
-                                try:
-                                    data_encerramento_dt = datetime.strptime(op['data_encerramento'], "%d/%m/%Y")
-                                    if data_encerramento_dt.month == target_month and data_encerramento_dt.year == target_year:
-                                        financeiro_encerrado_mes += op.get('quantidade', 0) * op.get('preco_encerramento', 0)
-                                        resultado_encerrado_mes += op.get('lucro_final', 0)
-                                except (ValueError, TypeError):
-                                    continue
-                                    
+                    resumo_historico = st.session_state.app_data["historico_resumo"].get(assessor, {})
+                    resumo_mes = resumo_historico.get("mensal", {}).get(f"{target_year}-{target_month:02d}", {})
+                    financeiro_encerrado_mes = resumo_mes.get("financeiro", 0)
+                    resultado_encerrado_mes = resumo_mes.get("resultado", 0)
+                    
                     metric_cols[1].metric(f"Financeiro Encerrado ({month_name})", f"R$ {financeiro_encerrado_mes:,.2f}")
                     metric_cols[2].metric(f"Resultado Encerrado ({month_name})", f"R$ {resultado_encerrado_mes:,.2f}")
                     
@@ -496,9 +802,11 @@ def main_app():
                                     st.rerun()
                             with col3:
                                 if st.button("🗑️", key=f"del_client_{assessor}_{cliente}", help=f"Excluir cliente {cliente}"):
-                                    del st.session_state.app_data["assessores"][assessor][cliente]
-                                    save_data_to_firestore(st.session_state.app_data)
-                                    st.rerun()
+                                    # O cliente só sai do documento principal se o arquivo foi excluído.
+                                    if delete_archived_client(st.session_state.app_data, assessor, cliente):
+                                        del st.session_state.app_data["assessores"][assessor][cliente]
+                                        save_data_to_firestore(st.session_state.app_data)
+                                        st.rerun()
                             
                             tab_ativas, tab_encerradas = st.tabs(["Operações Ativas", "Operações Encerradas"])
 
@@ -556,7 +864,7 @@ def main_app():
                                         if action_cols[1].button("🏁", key=f"close_op_{assessor_name}_{cliente_name}_{op_index}", help="Encerrar"): st.session_state.closing_operation = (assessor_name, cliente_name, op_index); st.rerun()
                                         if action_cols[2].button("🗑️", key=f"del_op_{assessor_name}_{cliente_name}_{op_index}"): operacoes.pop(op_index); save_data_to_firestore(st.session_state.app_data); st.rerun()
                                     else:
-                                        if action_cols[0].button("✏️", key=f"edit_closed_op_{assessor_name}_{cliente_name}_{op_index}", help="Editar Encerrada"): st.session_state.editing_operation = (assessor_name, cliente_name, op_index); st.rerun()
+                                        if action_cols[0].button("✏️", key=f"edit_closed_op_{assessor_name}_{cliente_name}_{op_index}", help="Editar Encerrada"): st.session_state.editing_operation = (assessor_name, cliente_name, op); st.rerun()
                                     st.markdown("</div>", unsafe_allow_html=True)
 
                             with tab_ativas:
@@ -572,16 +880,17 @@ def main_app():
                                             display_operation_row(op, i, True, assessor, cliente)
 
                             with tab_encerradas:
-                                operacoes_encerradas = [op for op in operacoes if op.get('status') == 'encerrada']
-                                if not operacoes_encerradas:
-                                    st.info("Nenhuma operação encerrada para este cliente.")
+                                operacoes_encerradas = encerradas_por_cliente.get((assessor, cliente), [])
+                                if not mostrar_encerradas:
+                                    st.info("Ative \"Carregar operações encerradas\" para consultar o histórico.")
+                                elif not operacoes_encerradas:
+                                    st.info("Nenhuma operação encerrada para este cliente no período.")
                                 else:
                                     headers = ["Ativo", "Tipo", "Qtd.", "Preço Exec.", "Preço Final", "Custo (R$)", "Lucro Líq.", "% Bruto", "% Líq.", "Data", "Ações"]
                                     cols_header = st.columns([1.5, 1, 1, 1.3, 1.5, 1.2, 1.3, 1.2, 1.2, 1.2, 1.2])
                                     for col, header in zip(cols_header, headers): col.markdown(f"**{header}**")
-                                    for i, op in enumerate(operacoes):
-                                        if op.get('status') == 'encerrada':
-                                            display_operation_row(op, i, False, assessor, cliente)
+                                    for op in operacoes_encerradas:
+                                        display_operation_row(op, op['id'], False, assessor, cliente)
 
     st.divider()
     # --- MÓDULO DE CONTROLE DE POTENCIAL ---
@@ -605,12 +914,13 @@ def main_app():
                 
                 volume_entrada = 0
                 volume_saida = 0
-                for assessor_clientes in st.session_state.app_data["assessores"].values():
+                for assessor, assessor_clientes in st.session_state.app_data["assessores"].items():
                     if client in assessor_clientes:
                         for op in assessor_clientes[client]:
                             volume_entrada += op['quantidade'] * op['preco_exec']
-                            if op.get('status') == 'encerrada':
-                                volume_saida += op['quantidade'] * op.get('preco_encerramento', 0)
+                        resumo_cliente = st.session_state.app_data["historico_resumo"].get(assessor, {}).get("clientes", {}).get(client, {})
+                        volume_entrada += resumo_cliente.get("volume_entrada", 0)
+                        volume_saida += resumo_cliente.get("volume_saida", 0)
                 
                 total_volume_entrada += volume_entrada
                 total_volume_saida += volume_saida
@@ -634,30 +944,55 @@ def main_app():
             assessores_selecionados = st.multiselect("Selecione os Assessores", options=assessores_disponiveis, default=assessores_disponiveis)
             status_relatorio = st.radio("Status das Operações para o Relatório", ["Ativas", "Encerradas", "Todas"], horizontal=True, key="report_status")
             
-            report_data = []
-            for assessor in assessores_selecionados:
-                for cliente, operacoes in st.session_state.app_data["assessores"].get(assessor, {}).items():
-                    for op in operacoes:
-                        status_op = op.get('status', 'ativa')
-                        if (status_relatorio == "Todas") or \
-                           (status_relatorio == "Ativas" and status_op == 'ativa') or \
-                           (status_relatorio == "Encerradas" and status_op == 'encerrada'):
-                            
-                            op_details = op.copy()
-                            op_details['assessor'] = assessor
-                            op_details['cliente'] = cliente
-                            report_data.append(op_details)
-            
-            if not report_data:
+            periodo_encerramento = None
+            if status_relatorio in ("Encerradas", "Todas"):
+                periodo_relatorio = st.date_input(
+                    "Período de Encerramento", (datetime.now() - timedelta(days=90), datetime.now()),
+                    format="DD/MM/YYYY", key="report_periodo"
+                )
+                if len(periodo_relatorio) == 2:
+                    periodo_encerramento = tuple(periodo_relatorio)
+
+            operations_table, report_indexes = get_report_table(status_relatorio, periodo_encerramento)
+
+            periodo_abertura = None
+            if st.checkbox("Filtrar por data de abertura", key="report_filtrar_abertura"):
+                periodo_abertura_input = st.date_input(
+                    "Período de Abertura", (datetime.now() - timedelta(days=90), datetime.now()),
+                    format="DD/MM/YYYY", key="report_periodo_abertura"
+                )
+                if len(periodo_abertura_input) == 2:
+                    periodo_abertura = periodo_abertura_input
+
+            fcol1, fcol2, fcol3, fcol4 = st.columns(4)
+            ativos_selecionados = fcol1.multiselect("Ativos", options=sorted(report_indexes['ativo'].keys()), key="report_ativos")
+            clientes_selecionados = fcol2.multiselect("Clientes", options=sorted(report_indexes['cliente'].keys()), key="report_clientes")
+            lucro_minimo = fcol3.number_input("Lucro Final Mínimo (R$)", value=None, format="%.2f", key="report_lucro_min", help="Considera apenas operações encerradas.")
+            lucro_maximo = fcol4.number_input("Lucro Final Máximo (R$)", value=None, format="%.2f", key="report_lucro_max", help="Considera apenas operações encerradas.")
+            agrupamento = st.radio("Agrupar por", ["Nenhum", "Mês", "Ativo", "Cliente"], horizontal=True, key="report_agrupamento")
+
+            status_filtro = {"Ativas": ['ativa'], "Encerradas": ['encerrada'], "Todas": None}[status_relatorio]
+            # Ativos e clientes vazios significam "todos"; a lista de assessores é sempre aplicada.
+            df_report = query_operations(
+                operations_table, report_indexes, status=status_filtro, assessores=assessores_selecionados,
+                clientes=clientes_selecionados or None, ativos=ativos_selecionados or None,
+                abertura=periodo_abertura, lucro_min=lucro_minimo, lucro_max=lucro_maximo,
+            )
+
+            if df_report.empty:
                 st.warning("Nenhuma operação encontrada para os filtros selecionados.")
             else:
-                df_report = pd.DataFrame(report_data)
-                
+                df_agrupado = aggregate_operations(df_report, agrupamento) if agrupamento != "Nenhum" else None
+                if df_agrupado is not None:
+                    st.dataframe(df_agrupado, use_container_width=True, hide_index=True)
+
                 col1, col2 = st.columns(2)
                 
                 output_excel = BytesIO()
                 with pd.ExcelWriter(output_excel, engine='xlsxwriter') as writer:
-                    df_report.to_excel(writer, index=False, sheet_name="Relatorio")
+                    df_report.to_excel(writer, index=False, sheet_name="Relatorio", columns=REPORT_EXPORT_COLUMNS)
+                    if df_agrupado is not None:
+                        df_agrupado.to_excel(writer, index=False, sheet_name="Agrupado")
                 
                 col1.download_button(
                     label="📥 Baixar Relatório em Excel", data=output_excel.getvalue(),